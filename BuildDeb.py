@@ -1,23 +1,25 @@
 #!/usr/bin/env python3
 import sys
-from io import StringIO, BytesIO
 from pathlib import Path, PurePath
 import struct
 import re
 import os
 from itertools import chain
+from functools import lru_cache
 import warnings
 import tarfile
-import csv
+import subprocess
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 import sh
 import gpg
-from tqdm.autonotebook import tqdm
+from tqdm import tqdm
 from hashlib import sha256
 
-import requests
 from pydebhelper import *
-from getLatestVersionAndURLWithGitHubAPI import getTargets
+from getLatestVersionAndURLWithGitHubAPI import getTargets, session
 
 CMakePreambleMessage = "CMake is used to control the software compilation process using simple platform and compiler independent configuration files. CMake generates native makefiles and workspaces that can be used in the compiler environment of your choice.\n\n"
 
@@ -111,8 +113,10 @@ def ripCMakePackage(unpackedDir, packagesDir, version, maintainer, builtDir, lic
 						aUnp = unpackedDir / a
 						pkg.rip(aUnp, "usr/share/" + a)
 					else:
-						for manF in (unpackedDir / sectionDir).iterdir():
-							pkg.rip(manF, "usr/share/"+str(manF.relative_to(unpackedDir)))
+						with os.scandir(unpackedDir / sectionDir) as it:
+							manFiles = [manF.name for manF in it] # collected first, since ripping moves the entries out of the dir being scanned
+						for manF in manFiles:
+							pkg.rip(unpackedDir / sectionDir / manF, "usr/share/" + sectionDir + "/" + manF)
 			
 			pkg.copy(licenseFilePath, "usr/share/doc/"+pkgName+"/copyright")
 			results[pkgName] = pkg
@@ -126,62 +130,131 @@ def ripCMakePackage(unpackedDir, packagesDir, version, maintainer, builtDir, lic
 		"conflicts": ("cmake-doc", ),
 		"replaces": ("cmake-doc", ),
 	}) as docPkg:
-		pkg.rip(unpackedDir / "doc", "usr/share/doc")
+		docPkg.rip(unpackedDir / "doc", "usr/share/doc")
 		results[ourCMakePrefix+"-doc"] = docPkg
 
 	return results
 
 
 
-def isSubdir(parent: Path, child: Path) -> bool:
-	parent = parent.absolute().resolve()
-	child = child.absolute().resolve().relative_to(parent)
-	for p in child.parts:
-		if p == "..":
-			return False
-	return True
-
-
-def unpack(archPath, extrDir):
-	extrDir = extrDir.resolve()
+def getUnpackedSize(archPath):
+	"""Reads ISIZE from the gzip trailer. It is the size modulo 2**32, but CMake tarballs are far smaller than that."""
 	packedSize = archPath.stat().st_size
 	with archPath.open("rb") as arch:
 		arch.seek(packedSize - 4)
-		unpackedSize = struct.unpack("<I", arch.read(4))[0]
+		return struct.unpack("<I", arch.read(4))[0]
+
+
+pipeChunkSize = 1024 * 1024
+
+
+def unpackWithPigz(archPath, extrDir, unpackedSize):
+	"""Streams `pigz -dc` into `tar -x` through a pipe. GNU tar itself refuses to extract members with absolute paths or `..` components."""
+	extrDir.mkdir(parents=True, exist_ok=True)
+	pigz = subprocess.Popen(["pigz", "-dc", str(archPath)], stdout=subprocess.PIPE)
+	tar = subprocess.Popen(["tar", "-xf", "-", "-C", str(extrDir)], stdin=subprocess.PIPE)
+	try:
+		src = pigz.stdout.fileno()
+		with tqdm(total=unpackedSize, unit="B", unit_divisor=1024, unit_scale=True, mininterval=0.5, miniters=pipeChunkSize) as pb:
+			while True:
+				chunk = os.read(src, pipeChunkSize)
+				if not chunk:
+					break
+				tar.stdin.write(chunk)
+				pb.update(len(chunk))
+	finally:
+		pigz.stdout.close()
+		tar.stdin.close()
+		pigzRes = pigz.wait()
+		tarRes = tar.wait()
+
+	if pigzRes:
+		raise subprocess.CalledProcessError(pigzRes, pigz.args)
+	if tarRes:
+		raise subprocess.CalledProcessError(tarRes, tar.args)
+
+
+tarCopyBufSize = 2 * 1024 * 1024 # the default is 16 KiB, which means a lot of tiny reads and writes
 
-	with tarfile.open(archPath, "r:gz") as arch:
-		with tqdm(total=unpackedSize, unit="B", unit_divisor=1024, unit_scale=True) as pb:
+
+def isWithin(rootAbs, pathAbs):
+	"""Both paths must be absolute and normalized; rootAbs must end with a separator"""
+	return pathAbs.startswith(rootAbs)
+
+
+# the "data" filter refuses members and links escaping the destination itself (Python 3.12+, also backported to some older ones)
+hasDataFilter = hasattr(tarfile, "data_filter")
+extractKwargs = {"filter": "data"} if hasDataFilter else {}
+
+
+def unpackWithTarfile(archPath, extrDir, unpackedSize):
+	# extrDir is fixed, so it is resolved once and the per-member check is a mere prefix test
+	rootAbs = os.path.join(os.path.realpath(extrDir), "")
+	with tarfile.open(archPath, "r:gz", copybufsize=tarCopyBufSize) as arch:
+		with tqdm(total=unpackedSize, unit="B", unit_divisor=1024, unit_scale=True, mininterval=0.5, miniters=pipeChunkSize) as pb:
 			for f in arch:
-				fp = (extrDir / f.name).absolute()
-				if isSubdir(extrDir, fp):
-					if fp.is_file() or fp.is_symlink():
-						fp.unlink()
-					fp.parent.mkdir(parents=True, exist_ok=True)
-					arch.extract(f, extrDir, set_attrs=True)
-					pb.set_postfix(file=str(fp.relative_to(extrDir)), refresh=False)
-					pb.update(f.size)
+				fpAbs = os.path.normpath(os.path.join(rootAbs, f.name))
+				if fpAbs + os.sep == rootAbs:
+					continue
+				if not isWithin(rootAbs, fpAbs + os.sep):
+					raise ValueError("Archive member " + repr(f.name) + " is outside of " + repr(rootAbs))
+
+				if not hasDataFilter:
+					# without the filter we have to catch escapes through symlinks ourselves, so the member's parent dir is resolved
+					parentAbs = os.path.join(os.path.realpath(os.path.dirname(fpAbs)), "")
+					if not isWithin(rootAbs, parentAbs):
+						raise ValueError("Archive member " + repr(f.name) + " is outside of " + repr(rootAbs))
+
+					if f.issym():
+						linkTargetAbs = os.path.normpath(os.path.join(parentAbs, f.linkname))
+					elif f.islnk():
+						linkTargetAbs = os.path.normpath(os.path.join(rootAbs, f.linkname))
+					else:
+						linkTargetAbs = None
+					if linkTargetAbs is not None and not isWithin(rootAbs, linkTargetAbs + os.sep):
+						raise ValueError("Archive member " + repr(f.name) + " links to " + repr(f.linkname) + ", which is outside of " + repr(rootAbs))
 
+				fp = Path(fpAbs)
+				if fp.is_file() or fp.is_symlink():
+					fp.unlink()
+				fp.parent.mkdir(parents=True, exist_ok=True)
+				arch.extract(f, extrDir, set_attrs=True, **extractKwargs)
+				pb.update(f.size)
 
 
-class HashesFilesDialect(csv.Dialect):
-	quoting=csv.QUOTE_NONE
-	delimiter=" "
-	lineterminator="\n"
+def unpack(archPath, extrDir, verify):
+	"""`verify` must raise if the archive is not the expected one. With pigz it runs concurrently with unpacking and the tree is removed if it fails; the tarfile fallback unpacks only a verified archive."""
+	extrDir = extrDir.resolve()
+	unpackedSize = getUnpackedSize(archPath)
+
+	if shutil.which("pigz") and shutil.which("tar"):
+		with ThreadPoolExecutor(1) as verifier:
+			verificationFuture = verifier.submit(verify)
+			unpackWithPigz(archPath, extrDir, unpackedSize)
+			try:
+				verificationFuture.result()
+			except BaseException:
+				shutil.rmtree(str(extrDir), ignore_errors=True)
+				raise
+	else:
+		warnings.warn("pigz is not available, falling back to the slow pure-Python `tarfile`")
+		verify()
+		unpackWithTarfile(archPath, extrDir, unpackedSize)
+
 
-def parseHashesFile(hashes:str):
-	res={}
-	with StringIO(hashes) as csvIO:
-		for line in csv.reader(csvIO, dialect=HashesFilesDialect):
-			res[line[2]]=line[0]
 
-	return res
+hashLineRx = re.compile(rb"^([0-9a-fA-F]{64})[ \t]+\*?(\S+)[ \t]*\r?$", re.MULTILINE) # sha256sum format, `*` marks binary mode
 
+def parseHashesFile(hashes: bytes):
+	return {m.group(2).decode("utf-8"): m.group(1).decode("ascii") for m in hashLineRx.finditer(hashes)}
 
-currentProcFileDescriptors = Path("/proc") / str(os.getpid()) / "fd"
 
-fj = sh.firejail.bake(noblacklist=str(currentProcFileDescriptors), _fg=True)
+def fetch(uri):
+	req = session.get(uri)
+	req.raise_for_status()
+	return req.content
+
 
-aria2c = fj.aria2c.bake(_fg=True, **{"continue": "true", "check-certificate": "true", "enable-mmap": "true", "optimize-concurrent-downloads": "true", "j": 16, "x": 16, "file-allocation": "falloc"})
 aria2c = sh.Command("/usr/bin/aria2c").bake(_fg=True, **{"continue": "true", "check-certificate": "true", "enable-mmap": "true", "optimize-concurrent-downloads": "true", "j": 16, "x": 16, "file-allocation": "falloc"})
 
 def download(targets):
@@ -190,46 +263,40 @@ def download(targets):
 	for dst, uri in targets.items():
 		args += [uri, linesep, " ", "out=", str(dst), linesep]
 
-	pO, pI = os.pipe()
-	with os.fdopen(pI, "w") as pIF:
-		pIF.write("".join(args))
-		pIF.flush()
+	with tempfile.NamedTemporaryFile("wt", suffix=".aria2", delete=False) as inputFile:
+		inputFile.write("".join(args))
 	try:
-		aria2c(**{"input-file": str(currentProcFileDescriptors / str(pO))})
+		aria2c(**{"input-file": inputFile.name})
 	finally:
-		os.close(pO)
-		try:
-			os.close(pI)
-		except:
-			pass
+		os.unlink(inputFile.name)
 
 versionRxText = "(?:\\d+\\.){1,2}\\d+(?:-rc\\d+)?"
-vmTagRx = re.compile("^v("+versionRxText+")$")
+vmTagRx = re.compile("^v("+versionRxText+")$", re.ASCII)
 platformMarker = "Linux-x86_64"
 hashFuncName = "SHA-256"
-downloadFileNameRx = re.compile("^" + "-".join(("cmake", versionRxText, platformMarker)) + "\\.tar\\.gz$")
+downloadFileNameRx = re.compile("^" + "-".join(("cmake", versionRxText, platformMarker)) + "\\.tar\\.gz$", re.ASCII)
 hashesFileNameRxText="-".join(("cmake", versionRxText,  hashFuncName)) + "\\.txt"
 hashesSigFileNameRxText=hashesFileNameRxText+"\\.(?:asc|sig|gpg)"
 signingKeyFingerprint="CBA23971357C2E6590D9EFD3EC8FEF3A7BFB4EDA"
-candidateDirRx = re.compile("^cmake-"+versionRxText+"$")
+candidateDirRx = re.compile("^cmake-"+versionRxText+"$", re.ASCII)
 licenseFileURI = "https://gitlab.kitware.com/cmake/cmake/raw/master/Copyright.txt"
 
 
 gpgContext = gpg.Context(armor=True, offline=True)
 
 def findKeyByFingerprint(fp):
-	for k in gpgContext.op_keylist_all():
-		if k.fpr == fp:
-			return k
+	return gpgContext.get_key(fp)
+
+@lru_cache()
+def getSubkeysFingerprints(keyFingerprint: str) -> frozenset:
+	return frozenset(sk.fpr for sk in findKeyByFingerprint(keyFingerprint).subkeys)
 
 def verifyBlob(signedData: bytes, signature: bytes, *, keyFingerprint:str=None, subkeyFingerprint:str=None):
-	allowedFingerprints=set()
+	allowedFingerprints=frozenset()
 	if keyFingerprint:
-		key=findKeyByFingerprint(keyFingerprint.upper())
-		for sk in key.subkeys:
-			allowedFingerprints.add(sk.fpr)
+		allowedFingerprints=getSubkeysFingerprints(keyFingerprint.upper())
 	elif subkeyFingerprint:
-		allowedFingerprints.add(subkeyFingerprint.upper())
+		allowedFingerprints=frozenset((subkeyFingerprint.upper(),))
 	
 	data, res = gpgContext.verify(signedData, signature)
 	#print(res)
@@ -241,12 +308,13 @@ def verifyBlob(signedData: bytes, signature: bytes, *, keyFingerprint:str=None,
 
 def findCMakeDataDir(cmakeUnpackedRoot):
 	cmakeDataDir=None
-	for cand in (cmakeUnpackedRoot / "share").iterdir():
-		#print(cand, cand.is_dir(), candidateDirRx.match(cand.name))
-		if cand.is_dir():
-			if candidateDirRx.match(cand.name):
-				cmakeDataDir = cand
-				break
+	with os.scandir(cmakeUnpackedRoot / "share") as it:
+		for cand in it:
+			#print(cand, cand.is_dir(), candidateDirRx.match(cand.name))
+			if cand.is_dir():
+				if candidateDirRx.match(cand.name):
+					cmakeDataDir = Path(cand.path)
+					break
 	return cmakeDataDir
 
 def doBuild():
@@ -262,8 +330,8 @@ def doBuild():
 
 	tgts=list(getTargets("Kitware/CMake", None, vmTagRx, {
 		"binary":downloadFileNameRx,
-		"hashes": re.compile("^" + hashesFileNameRxText + "$"),
-		"hashesSig": re.compile("^" + hashesSigFileNameRxText + "$"), 
+		"hashes": re.compile("^" + hashesFileNameRxText + "$", re.ASCII),
+		"hashesSig": re.compile("^" + hashesSigFileNameRxText + "$", re.ASCII),
 	}))
 	
 	selectedTarget = max(tgts)
@@ -272,26 +340,33 @@ def doBuild():
 	print("Selected release:", selectedTarget, file=sys.stderr)
 	
 
-	hashesRaw=requests.get(selectedTarget.files["hashes"].uri).content
-	hashesSigRaw=requests.get(selectedTarget.files["hashesSig"].uri).content
+	with ThreadPoolExecutor(2) as fetcher:
+		hashesRawFuture = fetcher.submit(fetch, selectedTarget.files["hashes"].uri)
+		hashesSigRawFuture = fetcher.submit(fetch, selectedTarget.files["hashesSig"].uri)
+		if not licenseFilePath.is_file(): # it is committed into the repo, fetched only if it is missing
+			licenseFilePath.parent.mkdir(parents=True, exist_ok=True)
+			licenseFilePath.write_bytes(fetch(licenseFileURI))
+		hashesRaw = hashesRawFuture.result()
+		hashesSigRaw = hashesSigRawFuture.result()
 
 	verifyBlob(hashesRaw, hashesSigRaw, keyFingerprint=signingKeyFingerprint)
 	
-	hashes = parseHashesFile(hashesRaw.decode("utf-8"))
+	hashes = parseHashesFile(hashesRaw)
 	archiveFileName = PurePath(selectedTarget.files["binary"].uri).name
 	archiveEtalonHash = hashes[archiveFileName].lower()
 
 	downloadTargets = {
 		archPath: selectedTarget.files["binary"].uri,
-		licenseFilePath: licenseFileURI
 	}
 
 	download(downloadTargets)
-	actualFileHash=sumFile(archPath, (sha256,))["sha256"]
-	if actualFileHash.lower() != archiveEtalonHash:
-		raise Exception("Bad hash for the downloaded archive!")
 
-	unpack(archPath, unpackDir)
+	def verifyArchive():
+		actualFileHash = sumFile(archPath, (sha256,))["sha256"]
+		if actualFileHash.lower() != archiveEtalonHash:
+			raise Exception("Bad hash for the downloaded archive!")
+
+	unpack(archPath, unpackDir, verifyArchive)
 
 	cmakeUnpackedRoot = unpackDir / ('cmake-'+selectedTarget.version+'-'+platformMarker)
 
@@ -303,8 +378,9 @@ def doBuild():
 	maintainer = Maintainer()
 	pkgs = ripCMakePackage(cmakeUnpackedRoot, packagesRootsDir, tgts[0].version, maintainer=maintainer, builtDir=builtDir, licenseFilePath=licenseFilePath)
 
-	for pkg in pkgs.values():
-		pkg.build()
+	# dpkg-deb runs as a subprocess, so threads are enough; processes would not bring the built paths back into our Package objects
+	with ThreadPoolExecutor(len(pkgs)) as builder:
+		list(builder.map(Package.build, pkgs.values())) # consuming the results reraises build errors
 	
 	with Repo(root=repoDir, descr=maintainer.name+"'s repo for apt with CMake binary packages, built from the official builds on GitHub") as r:
 		for pkg in pkgs.values():
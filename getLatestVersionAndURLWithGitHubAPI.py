@@ -1,28 +1,78 @@
 #!/usr/bin/env python3
 import sys
 from datetime import datetime
-from dateutil.parser import parse as parseDT
 import requests
+import requests.adapters
 import shlex
+import json
+import os
+from pathlib import Path
 import datetime
 import re
 import typing
+from functools import total_ordering
 
 
 GH_API_BASE = "https://api.github.com/"
+cacheDir = Path(".gh_cache")
 
+
+def parseDT(s: str) -> datetime.datetime:
+	"""GitHub always returns strict ISO 8601 in UTC, so no need for dateutil. fromisoformat accepts `Z` only since Python 3.11."""
+	return datetime.datetime.fromisoformat(s.replace("Z", "+00:00"))
+
+
+session = requests.Session()
+session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=3))
+session.headers["Accept-Encoding"] = "gzip, deflate"
+
+
+def getAuthHeaders():
+	token = os.environ.get("GITHUB_TOKEN", None)
+	if token:
+		return {"Authorization": "Bearer " + token}
+	return {}
+
+
+def getCached(uri, cacheFile):
+	"""GETs JSON conditionally, using an ETag stored in cacheFile. GitHub answers 304 without a body and without spending the rate limit if nothing has changed."""
+	cached = None
+	if cacheFile.is_file():
+		cached = json.loads(cacheFile.read_text())
+
+	headers = getAuthHeaders()
+	if cached is not None:
+		headers["If-None-Match"] = cached["etag"]
+
+	req = session.get(uri, headers=headers)
+	if req.status_code == 304:
+		return req, cached["body"]
+
+	t = req.json()
+	if req.status_code == 200 and "ETag" in req.headers:
+		cacheFile.parent.mkdir(parents=True, exist_ok=True)
+		cacheFile.write_text(json.dumps({"etag": req.headers["ETag"], "body": t}))
+	return req, t
+
+
+@total_ordering
 class ComparableDownloadTarget:
+	__slots__ = ("_cmp",) # the key is computed once in __init__ of a subclass, since max() and sorted() call the comparators many times
+
 	def cmpTuple(self) -> tuple:
-		raise NotImplementedError()
+		return self._cmp
 	
 	def __lt__(self, other):
-		return self.cmpTuple() < other.cmpTuple()
+		return self._cmp < other._cmp
 
 	def __gt__(self, other):
-		return self.cmpTuple() > other.cmpTuple()
+		return self._cmp > other._cmp
 
 	def __eq__(self, other):
-		return self.cmpTuple() == other.cmpTuple()
+		return self._cmp == other._cmp
+
+	def __hash__(self):
+		return hash(self._cmp)
 
 class DownloadTargetFile(ComparableDownloadTarget):
 	__slots__ = ("created", "modified", "uri", "role")
@@ -31,9 +81,7 @@ class DownloadTargetFile(ComparableDownloadTarget):
 		self.modified = modified
 		self.uri = uri
 		self.role = role
-
-	def cmpTuple(self):
-		return (self.created, self.modified)
+		self._cmp = (created, modified)
 
 	def __str__(self):
 		return self.role + "<" + self.uri + ">"
@@ -41,6 +89,7 @@ class DownloadTargetFile(ComparableDownloadTarget):
 
 
 class DownloadTarget(ComparableDownloadTarget):
+	__slots__ = ("name", "version", "prerelease", "created", "published", "files")
 	def __init__(self, name: str, version: str, prerelease: bool, created: datetime, published: datetime, files: typing.Dict[typing.Optional[str], DownloadTargetFile]):
 		self.name = name
 		self.version = version
@@ -48,23 +97,15 @@ class DownloadTarget(ComparableDownloadTarget):
 		self.created = created
 		self.published = published
 		self.files = files
-
-	def cmpTuple(self):
-		return (self.created, self.published)
+		self._cmp = (created, published)
 
 	def __str__(self):
 		return self.name + " (" + self.version + ", " + ("pre" if self.prerelease else "") + "release" + ") <" + repr(self.files) + ">"
 
 
 
-def getTargets(repoPath, titleRx, tagRx, downloadFileNamesRxs, signed=False):
-	if not isinstance(downloadFileNamesRxs, dict):
-		downloadFileNamesRxs = {None: downloadFileNamesRxs}
-	
-	RELEASES_EP = GH_API_BASE + "repos/" + repoPath + "/releases"
-
-	req = requests.get(RELEASES_EP)
-	headers = requests.utils.default_headers()
+def getReleasesJSON(uri, cacheFile):
+	req, t = getCached(uri, cacheFile)
 	h = req.headers
 	limitRemaining = int(h["X-RateLimit-Remaining"])
 	limitTotal = int(h["X-RateLimit-Limit"])
@@ -72,40 +113,54 @@ def getTargets(repoPath, titleRx, tagRx, downloadFileNamesRxs, signed=False):
 
 	print(limitRemaining, "/", limitTotal, str((limitRemaining / limitTotal)*100.)+"%", "limit will be reset:", limitResetTime, "in", limitResetTime - datetime.datetime.now())
 
-	t = req.json()
 	#print(t)
 
 	if isinstance(t, dict) and "message" in t:
 		raise Exception(t["message"])
+
+	return t
+
+
+def parseRelease(r, titleRx, tagRx, downloadFileNamesRxs):
+	nm = r["name"]
+	if titleRx is not None and not titleRx.match(nm):
+		return None
+	#print(r["tag_name"], tagRx.match(r["tag_name"]))
+	tagMatch = tagRx.match(r["tag_name"])
+
+	if not tagMatch:
+		return None
+
+	pr = r["prerelease"]
+	v = tagMatch.group(1)
+	#print("tagMatch.group(1)", tagMatch.group(1))
+	c = parseDT(r["created_at"])
+	#print("c", c)
+	p = parseDT(r["published_at"])
+	#print("p", p)
+	files = {}
+	for a in r["assets"]:
+		for role, downloadFileNameRx in downloadFileNamesRxs.items():
+			#print(a["name"], downloadFileNameRx.fullmatch(a["name"]))
+			if not downloadFileNameRx.fullmatch(a["name"]):
+				continue
+			fc = parseDT(a["created_at"])
+			m = parseDT(a["updated_at"])
+			files[role] = DownloadTargetFile(role, fc, m, a["browser_download_url"])
+			break # a file cannot have 2 roles
+	#print(files, len(files), len(downloadFileNamesRxs), len(files) == len(downloadFileNamesRxs))
+	if len(files) == len(downloadFileNamesRxs):
+		return DownloadTarget(nm, v, pr, c, p, files)
+	return None
+
+
+def getTargets(repoPath, titleRx, tagRx, downloadFileNamesRxs, signed=False):
+	if not isinstance(downloadFileNamesRxs, dict):
+		downloadFileNamesRxs = {None: downloadFileNamesRxs}
 	
+	RELEASES_EP = GH_API_BASE + "repos/" + repoPath + "/releases"
 
-	for r in t:
-		nm = r["name"]
-		if titleRx is not None and not titleRx.match(nm):
-			continue
-		#print(r["tag_name"], tagRx.match(r["tag_name"]))
-		tagMatch = tagRx.match(r["tag_name"])
-
-		if not tagMatch:
-			continue
-
-		pr = r["prerelease"]
-		v = tagMatch.group(1)
-		#print("tagMatch.group(1)", tagMatch.group(1))
-		c = parseDT(r["created_at"])
-		#print("c", c)
-		p = parseDT(r["published_at"])
-		#print("p", p)
-		files = {}
-		for a in r["assets"]:
-			for role, downloadFileNameRx in downloadFileNamesRxs.items():
-				#print(a["name"], downloadFileNameRx.match(a["name"]))
-				if not downloadFileNameRx.match(a["name"]):
-					continue
-				fc = parseDT(a["created_at"])
-				m = parseDT(a["updated_at"])
-				files[role] = DownloadTargetFile(role, fc, m, a["browser_download_url"])
-		#print(files, len(files), len(downloadFileNamesRxs), len(files) == len(downloadFileNamesRxs))
-		if len(files) == len(downloadFileNamesRxs):
-			yield DownloadTarget(nm, v, pr, c, p, files)
-		
+	for r in getReleasesJSON(RELEASES_EP, cacheDir / ("releases-" + repoPath.replace("/", "_") + ".json")):
+		tgt = parseRelease(r, titleRx, tagRx, downloadFileNamesRxs)
+		if tgt is not None:
+			yield tgt
@@ -1,5 +1,5 @@
 from collections import defaultdict, OrderedDict
-from pathlib import Path
+from pathlib import Path, PurePath
 from hashlib import md5, sha256, blake2b, sha3_512
 from os import readlink, linesep, fchdir
 import os
@@ -146,7 +146,7 @@ class Package:
 		if src.is_dir():
 			resPath.mkdir(parents=True, exist_ok=True)
 			for f in src.iterdir():
-				self.copy(f, resPath / f.name)
+				self.copy(f, PurePath(dst) / f.name)
 		else:
 			resPath.parent.mkdir(parents=True, exist_ok=True)
 			shutil.copy2(str(src), str(resPath))
@@ -156,22 +156,21 @@ class Package:
 
 
 	def rip(self, src, dst):
-		"""src is path, dst is an abstract path within root"""
+		"""src is path, dst is an abstract path within root. Dirs are moved as a whole, so usually it is a single rename."""
 		resPath = self.root / dst
 
 		if (resPath.exists() or resPath.is_symlink()) and not (src.exists() or src.is_symlink()):
 			warnings.warn(str(resPath) + " already exists")
-		elif (resPath.exists() and resPath.is_dir()):
-			self.copy(src, resPath)
+		elif resPath.is_dir() and src.is_dir() and not src.is_symlink():
+			# merging into an existing dir: move each entry as a whole instead of copying every file
+			with os.scandir(src) as it:
+				names = [e.name for e in it]
+			for name in names:
+				self.rip(src / name, PurePath(dst) / name)
 		else:
 			#print("src", src, "res", resPath, resPath.exists(), src.is_dir(), src.is_symlink())
-
-			if src.is_dir():
-				resPath.mkdir(parents=True, exist_ok=True)
-			else:
-				resPath.parent.mkdir(parents=True, exist_ok=True)
-
-			src.rename(resPath)
+			resPath.parent.mkdir(parents=True, exist_ok=True)
+			shutil.move(str(src), str(resPath)) # a rename, falls back to copying across filesystems
 
 			self.checksumPath(resPath)
 